@@ -1,27 +1,53 @@
 # --------- REQUIRES A SEPARATE CONDA ENVIRONMENT WITH CELLPOSE INSTALLED --------- #
 
 import pathlib as pt
-from glob import glob
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import numpy as np
 from cellpose.models import CellposeModel
-from tifffile import imread
+from tifffile import TiffFile
 
 VAL_PERCENT = 0.9
 SAVE_NAME = "c1245_v_1090.cellpose"
 CELL_MEAN_DIAM = 3.3
+NUM_WORKERS = 8
 
 
-def convert_2d(images_array, images_names=None, dtype=np.float32):
-    images_2d = []
-    images_names_2d = [] if images_names is not None else None
-    for i, image in enumerate(images_array):
-        for j, slice_ in enumerate(image):
-            images_2d.append(slice_.astype(dtype))
-            if images_names is not None:
-                images_names_2d.append(
-                    f"{pt.Path(images_names[i]).stem}_{j}.tif"
-                )
+def read_slices(path, dtype=np.float32):
+    """Read the first image series of a TIFF stack plane by plane, as a list of C-contiguous 2D arrays.
+
+    When every plane is stored in its own page, only one decoded page is held besides the output,
+    instead of the whole stack plus its cast copy. Otherwise (truncated ImageJ files, as written by
+    Fiji for stacks over 4 GB, or shallow stacks stored as a single multi-sample page) the series
+    is read at once and split into planes.
+    Slices are C-contiguous so Cellpose's dataloader does not re-copy them each epoch.
+    Pages already decoded with the target dtype (e.g. uint16 labels) are used as-is, without a copy.
+    """
+    with TiffFile(path) as tif:
+        series = tif.series[0]
+        plane_shape = series.shape[-2:]
+        n_planes = int(np.prod(series.shape[:-2]))
+        if len(series.pages) == n_planes:
+            blocks = (page.asarray(maxworkers=1) for page in series.pages)
+        else:
+            blocks = [series.asarray(maxworkers=1)]
+        return [
+            np.ascontiguousarray(plane, dtype=dtype)
+            for data in blocks
+            for plane in data.reshape(-1, *plane_shape)
+        ]
+
+
+def convert_2d(images_array, images_names=None):
+    images_2d = [slice_ for image in images_array for slice_ in image]
+    images_names_2d = None
+    if images_names is not None:
+        images_names_2d = [
+            f"{pt.Path(name).stem}_{j}.tif"
+            for name, image in zip(images_names, images_array)
+            for j in range(len(image))
+        ]
     return images_2d, images_names_2d
 
 
@@ -35,13 +61,21 @@ if __name__ == "__main__":
     # path_images = path_images / "1_c15"
     # path_images = path_images / "2_c1_c4_visual"
     path_images = path_images / "3_c1245_visual"
-    X_paths = sorted(glob(str(path_images / "*.tif")))
-    Y_paths = sorted(glob(str(path_images / "labels/*.tif")))
+    X_paths = sorted(path_images.glob("*.tif"))
+    Y_paths = sorted((path_images / "labels").glob("*.tif"))
 
-    X = list(map(imread, X_paths))
-    Y = list(map(imread, Y_paths))
+    # read stacks in parallel; tifffile's own decode pool is disabled to avoid oversubscription
+    with ThreadPoolExecutor(max_workers=NUM_WORKERS) as ex:
+        X = list(ex.map(partial(read_slices, dtype=np.float32), X_paths))
+        Y = list(ex.map(partial(read_slices, dtype=np.uint16), Y_paths))
+    assert len(X) == len(Y)
+    for x_path, x, y in zip(X_paths, X, Y):
+        if len(x) != len(y) or x[0].shape != y[0].shape:
+            raise ValueError(
+                f"Image {x_path} has shape {(len(x), *x[0].shape)} but its labels have shape {(len(y), *y[0].shape)}"
+            )
     X_2d, X_paths_2d = convert_2d(X, X_paths)
-    Y_2d, Y_paths_2d = convert_2d(Y, Y_paths, dtype=np.uint16)
+    Y_2d, Y_paths_2d = convert_2d(Y, Y_paths)
     print(len(X_2d))
     print(len(Y_2d))
     assert len(X_2d) == len(Y_2d)
@@ -58,9 +92,9 @@ if __name__ == "__main__":
     X_trn_paths = [X_paths_2d[i] for i in ind_train]
     X_val_paths = [X_paths_2d[i] for i in ind_val]
     print("Train :")
-    [print(p) for p in X_trn_paths]
+    print("\n".join(map(str, X_trn_paths)))
     print("Val :")
-    [print(p) for p in X_val_paths]
+    print("\n".join(map(str, X_val_paths)))
     print("*" * 20)
 
     print("Parameters :")
@@ -1,10 +1,11 @@
 import contextlib
+from collections import OrderedDict
 from pathlib import Path
 
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
-from matplotlib.colors import LinearSegmentedColormap
+from matplotlib.colors import Colormap, LinearSegmentedColormap
 
 from utils import (
     dataset_matching_stats_to_df,
@@ -15,6 +16,7 @@ from utils import (
     invert_color,
     precision,
     recall,
+    threshold_sweep_metrics,
 )
 
 ###############
@@ -50,6 +52,11 @@ COLORS_DICT = {
     "Swin": COLORMAP[3],
     "WNet3D": COLORMAP[4],
 }
+# colored blocks used to preview the colormap in the terminal
+COLORMAP_ANSI = [
+    f"\033[38;2;{int(color[1:3], 16)};{int(color[3:5], 16)};{int(color[5:], 16)}m█\033[0m"
+    for color in COLORMAP
+]
 ################ Plot settings
 DPI = 200
 FONT_SIZE = 20
@@ -58,17 +65,17 @@ LABEL_FONT_SIZE = np.floor(FONT_SIZE * 1)
 LEGEND_FONT_SIZE = np.floor(FONT_SIZE * 0.75)
 BBOX_TO_ANCHOR = (1.05, 1)
 LOC = "best"
+TAU_XTICKS = np.arange(0.1, 1, 0.1)
+DEFAULT_THRESHOLDS = np.arange(0, 1, 0.025)
 ################
+STATS_DF_CACHE_SIZE = 64
+_stats_df_cache = OrderedDict()
 
 
 def show_params():
     print("Plot parameters (set in plots.py) : \n- COLORMAP : ", end="")
     # print colormap with print statement colored with the colormap
-    for color in COLORMAP:
-        print(
-            f"\033[38;2;{int(color[1:3], 16)};{int(color[3:5], 16)};{int(color[5:], 16)}m█\033[0m",
-            end="",
-        )
+    print("".join(COLORMAP_ANSI), end="")
     print(
         f"\n- DPI : {DPI}\n- Data path : {DATA_PATH}\n- Font size : {FONT_SIZE}\n- Title font size : {TITLE_FONT_SIZE}\n- Label font size : {LABEL_FONT_SIZE}"
     )
@@ -125,28 +132,45 @@ def _format_plot(
     ax.grid(False)
 
 
+def _stats_to_df(stats):
+    """Cached dataset_matching_stats_to_df, so that plotting the same stats several times only builds the DataFrame once.
+
+    Entries are keyed by id and keep a reference to the stats, so an id cannot be reused while cached.
+    """
+    key = id(stats)
+    if key in _stats_df_cache and _stats_df_cache[key][0] is stats:
+        _stats_df_cache.move_to_end(key)
+        return _stats_df_cache[key][1]
+    df = dataset_matching_stats_to_df(stats)
+    _stats_df_cache[key] = (stats, df)
+    if len(_stats_df_cache) > STATS_DF_CACHE_SIZE:
+        _stats_df_cache.popitem(last=False)
+    return df
+
+
 ###################
 # PLOT FUNCTIONS  #
 ###################
 
 
 def plot_model_performance_semantic(
-    image, gt, name, threshold_range=None, print_max=True
+    image, gt, name, threshold_range=None, print_max=True, low_memory=False
 ):
-    """Plot the Dice, IoU, precision and recall for a given model and threshold range, across the specified threshold range between 0 and 1."""
+    """Plot the Dice, IoU, precision and recall for a given model and threshold range, across the specified threshold range between 0 and 1.
+
+    Set low_memory to True for volumes too large to be sorted in memory (requires numba).
+    """
     if threshold_range is None:
-        threshold_range = np.arange(0, 1, 0.025)
-
-    dice_scores = []
-    iou_scores = []
-    precision_scores = []
-    recall_scores = []
-    for threshold in threshold_range:
-        pred = np.where(image > threshold, 1, 0)
-        dice_scores.append(dice_coeff(gt, pred))
-        iou_scores.append(intersection_over_union(gt, pred))
-        precision_scores.append(precision(gt, pred))
-        recall_scores.append(recall(gt, pred))
+        threshold_range = DEFAULT_THRESHOLDS
+
+    (
+        dice_scores,
+        iou_scores,
+        precision_scores,
+        recall_scores,
+    ) = threshold_sweep_metrics(
+        image, gt, threshold_range, low_memory=low_memory
+    )
     plt.figure(figsize=(7, 7))
     plt.plot(threshold_range, dice_scores, label="Dice")
     plt.plot(threshold_range, iou_scores, label="IoU")
@@ -195,19 +219,13 @@ def plot_performance(
     ),
 ):
     with get_style_context():
-        sns.set_palette(COLORMAP)
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 6), dpi=DPI)
         fig.suptitle(name, fontsize=TITLE_FONT_SIZE)
-        stats = dataset_matching_stats_to_df(stats)
+        stats = _stats_to_df(stats)
+        # plain lines : one value per threshold, so no seaborn aggregation needed
         for m in stats_list:
-            sns.lineplot(
-                data=stats,
-                x="thresh",
-                y=m,
-                ax=ax1,
-                label=m,
-                lw=2,
-                marker="o",
+            ax1.plot(
+                stats.index.values, stats[m].values, label=m, lw=2, marker="o"
             )
         ax1.legend(
             fontsize=LEGEND_FONT_SIZE,
@@ -216,26 +234,20 @@ def plot_performance(
         )
         _format_plot(
             ax1,
-            xticks_arange=np.arange(0.1, 1, 0.1),
+            xticks_arange=TAU_XTICKS,
             xlabel=f"{metric}" + r" threshold $\tau$",
             ylabel="Metric value",
             title=name,
         )
 
         for m in ("fp", "tp", "fn"):
-            sns.lineplot(
-                data=stats,
-                x="thresh",
-                y=m,
-                ax=ax2,
-                label=m,
-                lw=2,
-                marker="o",
+            ax2.plot(
+                stats.index.values, stats[m].values, label=m, lw=2, marker="o"
             )
         # ax2.set_ylim(0, max([stats['tp'].max(), stats['fp'].max(), stats['fn'].max()]))
         _format_plot(
             ax2,
-            xticks_arange=np.arange(0.1, 1, 0.1),
+            xticks_arange=TAU_XTICKS,
             xlims=(0.05, 0.95),
             xlabel=f"{metric}" + r" threshold $\tau",
             ylabel="Number #",
@@ -268,30 +280,39 @@ def plot_stat_comparison(
     colormap=COLORMAP,
     plt_size=(12, 6),
     title=None,
+    ax=None,
 ):
-    """Compare one stat for several models on a single plot."""
+    """Compare one stat for several models on a single plot.
+
+    If ax is provided, plots into it (the title is then set on the axis instead of the figure), e.g. to draw several stats in one plt.subplots grid.
+    """
     with get_style_context():
-        sns.set_palette(colormap)
-        fig, ax = plt.subplots(1, 1, figsize=plt_size, dpi=DPI)
         stat_title = (stat[0].upper() + stat[1:]).replace("_", " ")
         suptitle = title if title is not None else f"{stat_title} comparison"
-        fig.suptitle(suptitle, fontsize=TITLE_FONT_SIZE)
-        stats_list = [
-            dataset_matching_stats_to_df(stats) for stats in stats_list
-        ]
+        if ax is None:
+            fig, ax = plt.subplots(1, 1, figsize=plt_size, dpi=DPI)
+            fig.suptitle(suptitle, fontsize=TITLE_FONT_SIZE)
+        else:
+            fig = ax.figure
+            ax.set_title(suptitle, fontsize=TITLE_FONT_SIZE)
+        stats_list = [_stats_to_df(stats) for stats in stats_list]
+        # resolve palette names, color lists or colormaps without touching the global palette
+        if isinstance(colormap, Colormap):
+            colors = colormap(np.linspace(0, 1, len(stats_list)))
+        else:
+            colors = sns.color_palette(colormap, n_colors=len(stats_list))
         for i, stats in enumerate(stats_list):
-            sns.lineplot(
-                data=stats,
-                x=taus,
-                y=stat,
-                ax=ax,
+            ax.plot(
+                taus,
+                stats[stat].values,
                 label=model_names[i],
+                color=colors[i],
                 lw=2,
                 marker="o",
             )
         _format_plot(
             ax,
-            xticks_arange=np.arange(0.1, 1, 0.1),
+            xticks_arange=TAU_XTICKS,
             xlims=(0.05, 0.95),
             ylims=(0, 1),
             xlabel=f"{metric}" + r" threshold $\tau$",
@@ -299,6 +320,7 @@ def plot_stat_comparison(
             # title=f"{stat_title} comparison"
         )
         sns.despine(
+            ax=ax,
             left=False,
             right=True,
             bottom=False,
@@ -352,7 +374,7 @@ def plot_stat_comparison_fold(
             ylims=ylims,
             xlabel=f"{metric}" + r" threshold $\tau$",
             ylabel=stat_title,
-            xticks_arange=np.arange(0.1, 1, 0.1),
+            xticks_arange=TAU_XTICKS,
         )
         sns.despine(
             left=False,
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+from tifffile import imwrite
+
+pytest.importorskip("cellpose")
+from train_on_splits import read_slices  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "write_kwargs",
+    [{}, {"imagej": True}, {"imagej": True, "truncate": True}],
+    ids=["pages", "imagej", "imagej_truncated"],
+)
+def test_read_slices_returns_every_plane(tmp_path, write_kwargs):
+    stack = np.arange(7 * 16 * 20, dtype=np.uint16).reshape(7, 16, 20)
+    path = tmp_path / "stack.tif"
+    imwrite(path, stack, **write_kwargs)
+
+    slices = read_slices(path, dtype=np.uint16)
+
+    assert len(slices) == 7
+    assert all(s.flags.c_contiguous for s in slices)
+    np.testing.assert_array_equal(np.stack(slices), stack)
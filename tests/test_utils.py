@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from utils import threshold_sweep_metrics
+
+
+def _reference_metrics(image, gt, thresholds):
+    dice, iou, prec, rec = [], [], [], []
+    gt_b = gt != 0
+    for t in thresholds:
+        pred = image > t
+        tp = np.count_nonzero(gt_b & pred)
+        n_pred, n_true = np.count_nonzero(pred), np.count_nonzero(gt_b)
+        dice.append((2.0 * tp + 1.0) / (n_true + n_pred + 1.0))
+        iou.append(tp / (n_true + n_pred - tp))
+        prec.append(tp / n_pred if n_pred else np.nan)
+        rec.append(tp / n_true)
+    return dice, iou, prec, rec
+
+
+@pytest.fixture
+def image_with_nan():
+    rng = np.random.default_rng(0)
+    image = rng.random((6, 10, 10)).astype(np.float32)
+    image[rng.random(image.shape) < 0.1] = np.nan
+    gt = (rng.random(image.shape) > 0.6).astype(np.uint8)
+    return image, gt
+
+
+def test_sweep_counts_nan_as_negative(image_with_nan):
+    image, gt = image_with_nan
+    thresholds = np.arange(0, 1, 0.025)
+
+    result = threshold_sweep_metrics(image, gt, thresholds)
+
+    for got, expected in zip(
+        result, _reference_metrics(image, gt, thresholds)
+    ):
+        np.testing.assert_allclose(got, expected, equal_nan=True)
+
+
+def test_sweep_paths_agree_with_nan(image_with_nan):
+    pytest.importorskip("numba")
+    image, gt = image_with_nan
+    thresholds = np.arange(0, 1, 0.025)
+
+    sorted_path = threshold_sweep_metrics(image, gt, thresholds)
+    jit_path = threshold_sweep_metrics(image, gt, thresholds, low_memory=True)
+
+    for a, b in zip(sorted_path, jit_path):
+        np.testing.assert_allclose(a, b, equal_nan=True)
+
+
+def test_sweep_small_nan_example():
+    image = np.array([0.2, np.nan, 0.9, 0.6])
+    gt = np.array([1, 1, 0, 1])
+
+    dice = threshold_sweep_metrics(image, gt, [0.5])[0]
+
+    np.testing.assert_allclose(dice, [0.5])
@@ -8,6 +8,11 @@ import pandas as pd
 import seaborn as sns
 from tifffile import imread
 
+try:
+    from numba import njit, prange
+except ImportError:  # numba is only needed for the low-memory threshold sweep
+    njit = None
+
 ###################
 # UTILS FUNCTIONS #
 ###################
@@ -114,23 +119,48 @@ def invert_color(hex_color):
     return rgb_to_hex(inverted_rgb)
 
 
+def _confusion(y_true, y_pred):
+    """Count true positives, false positives and false negatives between two masks (nonzero is foreground)."""
+    y_true_b = y_true.astype(bool, copy=False)
+    y_pred_b = y_pred.astype(bool, copy=False)
+    tp = np.count_nonzero(y_true_b & y_pred_b)
+    fp = np.count_nonzero(y_pred_b) - tp
+    fn = np.count_nonzero(y_true_b) - tp
+    return tp, fp, fn
+
+
+def _metrics_from_counts(tp, fp, fn):
+    """Dice (smoothed), IoU, precision and recall from confusion counts (scalars or arrays)."""
+    smooth = 1.0
+    tp = np.asarray(tp, dtype=np.float64)
+    dice = (2.0 * tp + smooth) / (2.0 * tp + fp + fn + smooth)
+    iou = tp / (tp + fp + fn)
+    prec = tp / (tp + fp)
+    rec = tp / (tp + fn)
+    return dice, iou, prec, rec
+
+
+def semantic_metrics(y_true: np.ndarray, y_pred: np.ndarray):
+    """Compute Dice, IoU, precision and recall between two numpy arrays, counting TP/FP/FN only once
+    Args:
+        y_true: Ground truth label (nonzero is foreground)
+        y_pred: Prediction label (nonzero is foreground)
+    Returns: dice coefficient, IoU, precision and recall.
+    """
+    return _metrics_from_counts(*_confusion(y_true, y_pred))
+
+
 def dice_coeff(
     y_true: np.ndarray,
     y_pred: np.ndarray,
 ) -> np.float64:
     """Compute Dice-Sorensen coefficient between two numpy arrays
     Args:
-        y_true: Ground truth label
-        y_pred: Prediction label
+        y_true: Ground truth label (nonzero is foreground)
+        y_pred: Prediction label (nonzero is foreground)
     Returns: dice coefficient.
     """
-    smooth = 1.0
-    y_true_f = y_true.flatten()
-    y_pred_f = y_pred.flatten()
-    intersection = np.sum(y_true_f * y_pred_f)
-    return (2.0 * intersection + smooth) / (
-        np.sum(y_true_f) + np.sum(y_pred_f) + smooth
-    )
+    return semantic_metrics(y_true, y_pred)[0]
 
 
 def intersection_over_union(
@@ -138,41 +168,98 @@ def intersection_over_union(
 ) -> np.float64:
     """Compute Intersection over Union between two numpy arrays
     Args:
-        y_true: Ground truth label
-        y_pred: Prediction label
+        y_true: Ground truth label (nonzero is foreground)
+        y_pred: Prediction label (nonzero is foreground)
     Returns: IoU.
     """
-    y_true_f = y_true.flatten()
-    y_pred_f = y_pred.flatten()
-    intersection = np.sum(y_true_f * y_pred_f)
-    union = np.sum(y_true_f) + np.sum(y_pred_f) - intersection
-    return intersection / union
+    return semantic_metrics(y_true, y_pred)[1]
 
 
 def precision(y_true: np.ndarray, y_pred: np.ndarray) -> np.float64:
     """Compute precision between two numpy arrays
     Args:
-        y_true: Ground truth label
-        y_pred: Prediction label
+        y_true: Ground truth label (nonzero is foreground)
+        y_pred: Prediction label (nonzero is foreground)
     Returns: precision.
     """
-    y_true_f = y_true.flatten()
-    y_pred_f = y_pred.flatten()
-    intersection = np.sum(y_true_f * y_pred_f)
-    return intersection / np.sum(y_pred_f)
+    return semantic_metrics(y_true, y_pred)[2]
 
 
 def recall(y_true: np.ndarray, y_pred: np.ndarray) -> np.float64:
     """Compute recall between two numpy arrays
     Args:
-        y_true: Ground truth label
-        y_pred: Prediction label
+        y_true: Ground truth label (nonzero is foreground)
+        y_pred: Prediction label (nonzero is foreground)
     Returns: recall.
     """
-    y_true_f = y_true.flatten()
-    y_pred_f = y_pred.flatten()
-    intersection = np.sum(y_true_f * y_pred_f)
-    return intersection / np.sum(y_true_f)
+    return semantic_metrics(y_true, y_pred)[3]
+
+
+def _sweep_counts_sorted(image_f, gt_f, thresholds):
+    """True positives and predicted positives per threshold, from a single sort of the image."""
+    # NaN is never > t, but argsort/searchsorted would place it above every threshold
+    valid = ~np.isnan(image_f)
+    n_valid = np.count_nonzero(valid)
+    if n_valid < image_f.size:
+        image_f, gt_f = image_f[valid], gt_f[valid]
+    order = np.argsort(image_f, kind="stable")
+    sorted_image = image_f[order]
+    sorted_gt = gt_f[order] != 0
+    # positives (in gt) found in sorted_image[i:], with a trailing 0 for i == N
+    cum_pos = np.append(np.cumsum(sorted_gt[::-1])[::-1], 0)
+    idx = np.searchsorted(sorted_image, thresholds, side="right")
+    return cum_pos[idx], n_valid - idx
+
+
+if njit is not None:
+
+    @njit(parallel=True, cache=True)
+    def _sweep_counts_jit(image_f, gt_f, thresholds):
+        """True positives and predicted positives per threshold, in one fused loop per threshold."""
+        tp = np.zeros(thresholds.size)
+        pred_pos = np.zeros(thresholds.size)
+        for k in prange(thresholds.size):
+            t = thresholds[k]
+            tp_k = 0.0
+            pred_k = 0.0
+            for i in range(image_f.size):
+                if image_f[i] > t:
+                    pred_k += 1.0
+                    if gt_f[i] != 0:
+                        tp_k += 1.0
+            tp[k] = tp_k
+            pred_pos[k] = pred_k
+        return tp, pred_pos
+
+
+def threshold_sweep_metrics(image, gt, thresholds, low_memory=False):
+    """Compute Dice, IoU, precision and recall of ``image > t`` against gt for every threshold t.
+
+    By default the image is sorted once, and the counts of true positives and predicted positives
+    for each threshold are read from cumulative sums, instead of thresholding and scanning the whole
+    volume once per threshold and per metric.
+    With low_memory=True, the sort (which needs several copies of the volume) is replaced by a
+    numba-compiled loop that streams the volume once per threshold, without any temporary array.
+
+    Args:
+        image: Prediction to threshold (probabilities).
+        gt: Ground truth label (nonzero is foreground)
+        thresholds: Thresholds to evaluate
+        low_memory: Use the numba loop instead of sorting the image. Requires numba.
+    Returns: dice, iou, precision and recall as arrays, one value per threshold.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    image_f = image.ravel()
+    gt_f = gt.ravel()
+    if low_memory:
+        if njit is None:
+            raise ImportError("low_memory=True requires numba to be installed")
+        tp, pred_pos = _sweep_counts_jit(image_f, gt_f, thresholds)
+    else:
+        tp, pred_pos = _sweep_counts_sorted(image_f, gt_f, thresholds)
+    total_pos = np.count_nonzero(gt_f)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return _metrics_from_counts(tp, pred_pos - tp, total_pos - tp)
 
 
 def models_stats_to_df(model_stats, names):